@@ -2,12 +2,28 @@ import streamlit as st
 import pdfplumber
 import pandas as pd
 import re
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
+from operator import itemgetter
 
-# --- 1. Professional UI Configuration ---
-st.set_page_config(page_title="Form 16A TDS Extractor", layout="centered")
+# Regex patterns used for every certificate, compiled once at import
+QUARTER_RE = re.compile(r"Summary of tax deducted.*?\nQ([1-4])", re.DOTALL)
+DEDUCTOR_RE = re.compile(r"Name and address of the deductor[^\n]*\n\s*([^\n]*\S)")
+CHALLAN_RE = re.compile(r"(\d+\.\d{2})\s+\d{7}\s+(\d{2}-\d{2}-\d{4})")
+# Challan and payment rows in one pass; the challan branch comes first so an all-digit
+# BSR code starting with 194 is not also read as a 194x section payment
+TRANSACTION_RE = re.compile(
+    r"(\d+\.\d{2})\s+\d{7}\s+(\d{2}-\d{2}-\d{4})"
+    r"|(\d{2,}\.\d{2})\s+194\w+\s+(\d{2}-\d{2}-\d{4})"
+)
+
+# Fewest pages worth handing to a separate worker process
+MIN_PAGES_PER_WORKER = 10
 
-st.markdown("""
+# --- 1. Professional UI Configuration ---
+PAGE_CSS = """
     <style>
     body, .stApp {
         background-color: #0f0f0f;
@@ -37,137 +53,237 @@ st.markdown("""
         padding-top: 20px;
     }
     </style>
-""", unsafe_allow_html=True)
+"""
+
+@st.cache_resource
+def inject_css():
+    """Emits the page styles; cached so reruns replay the element instead of rebuilding it."""
+    st.markdown(PAGE_CSS, unsafe_allow_html=True)
+
+def setup_page():
+    st.set_page_config(page_title="Form 16A TDS Extractor", layout="centered")
 
-st.title("Form 16A TDS Extractor")
+    inject_css()
+
+    st.title("Form 16A TDS Extractor")
 
 # --- 2. Core Extraction Logic ---
-def extract_data_final(pdf_file):
+def is_pan(text):
+    """Checks for a PAN: five uppercase letters, four digits and an uppercase letter."""
+    return (len(text) == 10 and text.isascii() and text[:5].isalpha() and text[:5].isupper()
+            and text[5:9].isdigit() and text[9].isalpha() and text[9].isupper())
+
+def is_certificate_start(text):
+    """Checks whether a page's text is the first page of a Form 16A certificate."""
+    return "FORM NO. 16A" in text and "Certificate under section 203" in text
+
+def read_pages(pdf_source, first_page, last_page):
+    """
+    Extracts the text of pages [first_page, last_page) of the PDF, plus the
+    header words of pages that start a certificate. pdf_source is a file path
+    or file object; worker processes get a path and open their own copy.
+    """
+    page_data = []
+    # pdfplumber numbers pages from 1 and only builds Page objects for the requested ones
+    with pdfplumber.open(pdf_source, pages=range(first_page + 1, last_page + 1)) as pdf:
+        for page in pdf.pages:
+            text = page.extract_text(x_tolerance=2) or ""
+            words = None
+            # Header words are only needed for certificates that have 194x payment rows to report
+            if is_certificate_start(text) and "194" in text:
+                # PAN and Deductee Name bands both sit above top=275, so only cluster the header chars into words
+                header_chars = [c for c in page.chars if c["top"] < 300]
+                words = pdfplumber.utils.extract_words(header_chars, x_tolerance=2)
+            page_data.append((text, words))
+            # Free the page's parsed chars and layout objects; only the extracted strings are kept
+            page.close()
+    return page_data
+
+def read_all_pages(pdf_bytes, page_count):
+    """
+    Reads every page of the PDF, splitting the document into contiguous
+    page ranges that are processed in parallel across CPU cores.
+    """
+    # Each worker re-opens the PDF, so small files are cheaper to read in-process
+    workers = min(os.cpu_count() or 1, page_count // MIN_PAGES_PER_WORKER)
+    if workers <= 1:
+        return read_pages(BytesIO(pdf_bytes), 0, page_count)
+
+    chunk_size = -(-page_count // workers)
+    ranges = [(first, min(first + chunk_size, page_count)) for first in range(0, page_count, chunk_size)]
+
+    # Workers read the PDF from one temporary file instead of each receiving a pickled copy of the bytes
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as pdf_file:
+        pdf_file.write(pdf_bytes)
+    try:
+        with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [executor.submit(read_pages, pdf_file.name, first, last) for first, last in ranges]
+            return [page for future in futures for page in future.result()]
+    finally:
+        os.remove(pdf_file.name)
+
+@st.cache_data(show_spinner=False)
+def extract_data_final(pdf_bytes):
     """
     Final extractor using a hybrid of original logic and robust page handling,
     with corrected TDS extraction logic for all pages.
+    Results are cached on the PDF bytes, so Streamlit reruns do not re-parse the same upload.
     """
-    all_records = []
+    records = {
+        "Quarter": [], "Date of Deduction": [], "Deductee Name": [], "PAN": [],
+        "Taxable Value": [], "TDS Amount": [], "Deductor Name": []
+    }
     
     try:
-        with pdfplumber.open(pdf_file) as pdf:
-            # Robustly find the start page of each Form 16A certificate
-            start_page_indices = [i for i, page in enumerate(pdf.pages) if "Certificate under section 203" in (page.extract_text() or "") and "FORM NO. 16A" in (page.extract_text() or "")]
+        with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+            page_count = len(pdf.pages)
 
-            if not start_page_indices:
-                st.error("Error: Could not find any valid Form 16A certificates in the PDF.")
-                return pd.DataFrame()
+        # Extract each page's text once; it is reused for start-page detection and parsing
+        page_data = read_all_pages(pdf_bytes, page_count)
+        page_texts = [text for text, _ in page_data]
 
-            for i, start_index in enumerate(start_page_indices):
-                end_index = start_page_indices[i + 1] if i + 1 < len(start_page_indices) else len(pdf.pages)
-                
-                # --- PROCESS PAGE 1 ---
-                page1 = pdf.pages[start_index]
-                words1 = page1.extract_words(x_tolerance=2)
-                text1 = page1.extract_text(x_tolerance=2) or ""
+        # Robustly find the start page of each Form 16A certificate
+        start_page_indices = [i for i, text in enumerate(page_texts) if is_certificate_start(text)]
 
-                current_pan, current_deductee, current_deductor, quarter = "Unknown", "Unknown", "Unknown", "Unknown"
+        if not start_page_indices:
+            st.error("Error: Could not find any valid Form 16A certificates in the PDF.")
+            return pd.DataFrame()
 
-                # Your original coordinate logic for PAN
-                for w in words1:
-                    if 265 < w["top"] < 275 and 455 < w["x0"] < 510 and re.fullmatch(r"[A-Z]{5}[0-9]{4}[A-Z]", w["text"]):
+        for i, start_index in enumerate(start_page_indices):
+            end_index = start_page_indices[i + 1] if i + 1 < len(start_page_indices) else page_count
+            
+            # --- PROCESS PAGE 1 ---
+            text1, words1 = page_data[start_index]
+
+            # Records need a 194x payment row on Page 1; skip certificates that cannot produce any
+            if "194" not in text1:
+                continue
+
+            current_pan, current_deductee, current_deductor, quarter = "Unknown", "Unknown", "Unknown", "Unknown"
+
+            # Your original coordinate logic for PAN and Deductee Name, in a single pass over the words
+            name_band = []
+            for w in words1:
+                if 265 < w["top"] < 275 and 455 < w["x0"] < 510:
+                    if current_pan == "Unknown" and is_pan(w["text"]):
                         current_pan = w["text"]
-                        break
+                elif 185 < w["top"] < 195 and 300 < w["x0"] < 540:
+                    name_band.append(w)
+
+            name_band.sort(key=itemgetter("x0"))
+            current_deductee = " ".join([w["text"] for w in name_band]).strip() or "Unknown"
+
+            # Labels are located with a plain substring find; the regex then only runs from that point
+            # Deductor Name is the first non-blank line after its label
+            deductor_pos = text1.find("Name and address of the deductor")
+            deductor_match = DEDUCTOR_RE.match(text1, deductor_pos) if deductor_pos >= 0 else None
+            if deductor_match:
+                current_deductor = deductor_match.group(1)
+
+            # Your original logic for Quarter
+            quarter_pos = text1.find("Summary of tax deducted")
+            quarter_match = QUARTER_RE.match(text1, quarter_pos) if quarter_pos >= 0 else None
+            if quarter_match:
+                quarter = f"Q{quarter_match.group(1)}"
+
+            # --- Transaction Extraction for Page 1---
+            # Payments and challans (using the more robust TDS regex) are collected in a single scan
+            payments1, challans1 = [], []
+            for match in TRANSACTION_RE.finditer(text1):
+                tds_val, challan_date, taxable_val, pay_date = match.groups()
+                if tds_val:
+                    challans1.append((tds_val, challan_date))
+                else:
+                    payments1.append((taxable_val, pay_date))
+
+            # Each payment is paired with the challan in the same position
+            pairs = list(zip(payments1, challans1))
+
+            # --- PROCESS PAGE 2 (if it exists) using Page 1 Headers ---
+            # Page 2 challans only pair with Page 1 payments left unmatched, so skip it when there are none
+            if start_index + 1 < end_index and len(payments1) > len(challans1):
+                text2 = page_texts[start_index + 1]
                 
-                # Your original coordinate logic for Deductee Name
-                name_band = sorted([w for w in words1 if 185 < w["top"] < 195 and 300 < w["x0"] < 540], key=lambda x: x["x0"])
-                current_deductee = " ".join([w["text"] for w in name_band]).strip() or "Unknown"
-
-                # Your original logic for Deductor Name
-                for line_idx, line in enumerate(text1.splitlines()):
-                    if "Name and address of the deductor" in line:
-                        for next_line in text1.splitlines()[line_idx + 1:]:
-                            if next_line.strip():
-                                current_deductor = next_line.strip()
-                                break
-                        break
-
-                # Your original logic for Quarter
-                quarter_match = re.search(r"Summary of tax deducted.*?\nQ([1-4])", text1, re.DOTALL)
-                if quarter_match:
-                    quarter = f"Q{quarter_match.group(1)}"
-
-                # --- Transaction Extraction for Page 1---
-                payments1 = re.findall(r"(\d{2,}\.\d{2})\s+194\w+\s+(\d{2}-\d{2}-\d{4})", text1)
-                # Using the more robust TDS regex that previously worked for all pages
-                challans1 = re.findall(r"(\d+\.\d{2})\s+\d{7}\s+(\d{2}-\d{2}-\d{4})", text1)
+                # Page 2 often only contains the challan (TDS) table continuation.
+                # We will find all challans on this page and pair them with remaining payments if any,
+                # or log them even if payment details are not on the same page.
                 
-                for j in range(min(len(payments1), len(challans1))):
-                    taxable_val, pay_date = payments1[j]
-                    tds_val, _ = challans1[j]
-                    rate = round((float(tds_val) / float(taxable_val)) * 100, 2) if float(taxable_val) > 0 else 0.0
-                    all_records.append({
-                        "Quarter": quarter, "Date of Deduction": pay_date, "Deductee Name": current_deductee,
-                        "PAN": current_pan, "Taxable Value": float(taxable_val), "Rate (%)": f"{rate:.2f}",
-                        "TDS Amount": float(tds_val), "Deductor Name": current_deductor
-                    })
-
-                # --- PROCESS PAGE 2 (if it exists) using Page 1 Headers ---
-                if start_index + 1 < end_index:
-                    page2 = pdf.pages[start_index + 1]
-                    text2 = page2.extract_text() or ""
-                    
-                    # Page 2 often only contains the challan (TDS) table continuation.
-                    # We will find all challans on this page and pair them with remaining payments if any,
-                    # or log them even if payment details are not on the same page.
-                    
-                    # Using the robust TDS regex for Page 2
-                    challans2 = re.findall(r"(\d+\.\d{2})\s+\d{7}\s+(\d{2}-\d{2}-\d{4})", text2)
-
-                    # For simplicity and accuracy, we assume challans on page 2 correspond to later payments
-                    # We will match the found challans to the remaining payments from page 1
-                    remaining_payments = payments1[len(challans1):]
-                    
-                    for j in range(min(len(remaining_payments), len(challans2))):
-                        taxable_val, pay_date = remaining_payments[j]
-                        tds_val, _ = challans2[j]
-                        rate = round((float(tds_val) / float(taxable_val)) * 100, 2) if float(taxable_val) > 0 else 0.0
-                        all_records.append({
-                            "Quarter": quarter, "Date of Deduction": pay_date, "Deductee Name": current_deductee,
-                            "PAN": current_pan, "Taxable Value": float(taxable_val), "Rate (%)": f"{rate:.2f}",
-                            "TDS Amount": float(tds_val), "Deductor Name": current_deductor
-                        })
+                # Using the robust TDS regex for Page 2
+                challans2 = CHALLAN_RE.findall(text2)
+
+                # For simplicity and accuracy, we assume challans on page 2 correspond to later payments
+                # We will match the found challans to the remaining payments from page 1
+                remaining_payments = payments1[len(challans1):]
+                pairs.extend(zip(remaining_payments, challans2))
+
+            for (taxable_val, pay_date), (tds_val, _) in pairs:
+                records["Quarter"].append(quarter)
+                records["Date of Deduction"].append(pay_date)
+                records["Deductee Name"].append(current_deductee)
+                records["PAN"].append(current_pan)
+                records["Taxable Value"].append(taxable_val)
+                records["TDS Amount"].append(tds_val)
+                records["Deductor Name"].append(current_deductor)
 
     except Exception as e:
         st.error(f"An unexpected error occurred during processing: {e}")
         return pd.DataFrame()
-        
-    return pd.DataFrame(all_records)
+
+    df = pd.DataFrame(records)
+    if df.empty:
+        return df
+
+    # Amounts are collected as the matched strings and parsed in one pass per column
+    df[["Taxable Value", "TDS Amount"]] = df[["Taxable Value", "TDS Amount"]].astype(float)
+
+    # Rate is computed for all rows at once rather than per record
+    taxable = df["Taxable Value"]
+    rate = (df["TDS Amount"] / taxable * 100).where(taxable > 0, 0.0).round(2)
+    df.insert(df.columns.get_loc("Taxable Value") + 1, "Rate (%)", rate)
+    return df
+
+@st.cache_data
+def convert_df_to_excel(df):
+    buffer = BytesIO()
+    # xlsxwriter serialises cells directly instead of building an openpyxl object per cell
+    with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
+        df.to_excel(writer, index=False, sheet_name='TDS_Data')
+        # Rate (%) is stored as a number, so give it a two-decimal display format
+        rate_col = df.columns.get_loc("Rate (%)")
+        writer.sheets['TDS_Data'].set_column(rate_col, rate_col, None, writer.book.add_format({"num_format": "0.00"}))
+    return buffer.getvalue()
 
 # --- 3. Main Application Flow ---
-uploaded_file = st.file_uploader("Upload Merged Form 16A PDF File", type="pdf")
+def main():
+    setup_page()
 
-if uploaded_file is not None:
-    if st.button("Extract Data"):
-        with st.spinner("Processing PDF..."):
-            extracted_df = extract_data_final(uploaded_file)
+    uploaded_file = st.file_uploader("Upload Merged Form 16A PDF File", type="pdf")
 
-        if not extracted_df.empty:
-            st.success(f"Extraction Complete! Found {len(extracted_df)} total records.")
+    if uploaded_file is not None:
+        if st.button("Extract Data"):
+            with st.spinner("Processing PDF..."):
+                extracted_df = extract_data_final(uploaded_file.getvalue())
+
+            if not extracted_df.empty:
+                st.success(f"Extraction Complete! Found {len(extracted_df)} total records.")
             
-            st.dataframe(extracted_df.style.format({
-                "Taxable Value": "₹{:,.2f}",
-                "TDS Amount": "₹{:,.2f}"
-            }))
-
-            @st.cache_data
-            def convert_df_to_excel(df):
-                buffer = BytesIO()
-                df.to_excel(buffer, index=False, sheet_name='TDS_Data')
-                return buffer.getvalue()
-
-            excel_data = convert_df_to_excel(extracted_df)
-
-            st.download_button(
-                label="Download as Excel File",
-                data=excel_data,
-                file_name="TDS_Data_Extract.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-        else:
-            st.warning("Extraction complete, but no transaction data was found. Please verify the PDF format.")
+                st.dataframe(extracted_df.style.format({
+                    "Taxable Value": "₹{:,.2f}",
+                    "Rate (%)": "{:.2f}",
+                    "TDS Amount": "₹{:,.2f}"
+                }))
+
+                excel_data = convert_df_to_excel(extracted_df)
+
+                st.download_button(
+                    label="Download as Excel File",
+                    data=excel_data,
+                    file_name="TDS_Data_Extract.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
+            else:
+                st.warning("Extraction complete, but no transaction data was found. Please verify the PDF format.")
+
+# Worker processes re-import this module when they are spawned, so the UI only runs as the main script
+if __name__ == "__main__":
+    main()